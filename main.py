@@ -1,13 +1,148 @@
-from typing import Dict, List
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
 from autogen import ConversableAgent
+import httpx
+import asyncio
+import json
 import sys
 import os
 import re
 import math
+import mmap
+import threading
 from dotenv import load_dotenv
 
+try:
+    import orjson
+    _json_loads = orjson.loads
+except ImportError:
+    _json_loads = json.loads
+
 load_dotenv()
 
+# Constante 10 / sqrt(125) da fórmula de pontuação, calculada uma única vez
+_INV_SQRT_125_TIMES_10 = 10.0 / math.sqrt(125.0)
+
+class _SharedHTTPClient(httpx.Client):
+    """
+    Cliente HTTP que sobrevive ao deepcopy feito pelo autogen na configuração de cada agente,
+    mantendo um único pool de conexões compartilhado por todos eles.
+    """
+    
+    def __deepcopy__(self, memo):
+        return self
+
+
+# Cliente HTTP único com conexões persistentes, evitando novo handshake TLS a cada chamada ao modelo
+_HTTP_CLIENT = _SharedHTTPClient(limits=httpx.Limits(max_keepalive_connections=64))
+
+# Configuração do modelo compartilhada por todos os agentes (autogen a copia internamente)
+_LLM_CONFIG = {
+    "config_list": [
+        {
+            "model": "gpt-4o-mini",
+            "api_key": os.environ.get("OPENAI_API_KEY"),
+            "http_client": _HTTP_CLIENT
+        }
+    ]
+}
+
+# Padrões usados para extrair os scores da resposta e o restaurante da consulta
+_SCORES_RE = re.compile(
+    r'food_scores:\s*\[([^\]]+)\].*customer_service_scores:\s*\[([^\]]+)\]',
+    re.DOTALL
+)
+_RESTAURANT_RE = re.compile(r'(?:do|da) ([^?]+)\?', re.IGNORECASE)
+_PUNCTUATION_RE = re.compile(r'[^\w\s]')
+
+# Pontuações já calculadas, por (consulta normalizada, data de modificação de restaurantes.txt).
+# Guarda (restaurante, pontuação) para que a resposta use o nome como escrito em cada consulta.
+_ANSWER_CACHE_SIZE = 512
+_ANSWER_CACHE: "OrderedDict[Tuple[str, int], Tuple[str, float]]" = OrderedDict()
+
+# Índice nome do restaurante -> avaliações, reconstruído quando restaurantes.txt muda
+_REVIEW_INDEX: Optional[Dict[str, List[str]]] = None
+_INDEX_MTIME = 0
+_INDEX_LOCK = threading.Lock()
+
+
+def _build_index(file) -> Dict[str, List[str]]:
+    """
+    Percorre o arquivo mapeado em memória localizando quebras de linha e o primeiro "."
+    de cada linha diretamente nos bytes, decodificando apenas o nome e a avaliação.
+    """
+    index: Dict[str, List[str]] = {}
+    try:
+        mm = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+    except ValueError:
+        # Arquivo vazio não pode ser mapeado
+        return index
+    
+    with mm:
+        size = len(mm)
+        start = 0
+        while start < size:
+            end = mm.find(b"\n", start)
+            if end == -1:
+                end = size
+            dot = mm.find(b".", start, end)
+            if dot != -1:
+                name = mm[start:dot].decode("utf-8").strip()
+                review = mm[dot + 1:end].decode("utf-8").strip()
+                index.setdefault(name, []).append(review)
+            start = end + 1
+    
+    return index
+
+
+def _reviews_mtime() -> int:
+    """
+    Retorna o instante da última modificação de restaurantes.txt (0 se o arquivo não existir).
+    Usado como parte da chave dos caches, que são invalidados quando o arquivo muda.
+    """
+    try:
+        return os.stat("restaurantes.txt").st_mtime_ns
+    except FileNotFoundError:
+        return 0
+
+
+def _load_index(mtime: int) -> Dict[str, List[str]]:
+    """
+    Lê restaurantes.txt e indexa as avaliações pelo nome do restaurante, relendo o arquivo
+    apenas quando sua data de modificação muda.
+    
+    Args:
+        mtime: Data de modificação atual do arquivo, obtida com _reviews_mtime
+        
+    Returns:
+        Dicionário com o nome do restaurante como chave e lista de avaliações como valor
+    """
+    global _REVIEW_INDEX, _INDEX_MTIME
+    if _REVIEW_INDEX is not None and _INDEX_MTIME == mtime:
+        return _REVIEW_INDEX
+    
+    with _INDEX_LOCK:
+        if _REVIEW_INDEX is None or _INDEX_MTIME != mtime:
+            try:
+                with open("restaurantes.txt", "rb") as file:
+                    _REVIEW_INDEX = _build_index(file)
+            except FileNotFoundError:
+                return {}
+            _INDEX_MTIME = mtime
+        
+        return _REVIEW_INDEX
+
+
+@lru_cache(maxsize=1024)
+def _fetch_cached(restaurant_name: str, mtime: int) -> Tuple[str, ...]:
+    """
+    Busca no índice as avaliações de um restaurante, memorizando o resultado imutável
+    para cada versão do arquivo.
+    """
+    return tuple(_load_index(mtime).get(restaurant_name, ()))
+
 
 def fetch_restaurant_data(restaurant_name: str) -> Dict[str, List[str]]:
     """
@@ -22,27 +157,39 @@ def fetch_restaurant_data(restaurant_name: str) -> Dict[str, List[str]]:
     Example:
         {"Santo Pão": ["Sanduíches e sopas de boa qualidade...", "Atendimento eficiente..."]}
     """
-    try:
-        with open("restaurantes.txt", "r", encoding="utf-8") as file:
-            lines = file.readlines()
-    except FileNotFoundError:
-        return {restaurant_name: []}
-    
-    reviews = []
-    
-    for line in lines:
-        line = line.strip()
-        if line.startswith(restaurant_name + "."):
-            review = line.split(".", 1)[1].strip()
-            reviews.append(review)
+    return {restaurant_name: list(_fetch_cached(restaurant_name, _reviews_mtime()))}
+
+
+def fetch_restaurants_data(restaurant_names: List[str]) -> Dict[str, List[str]]:
+    """
+    Recupera de uma só vez as avaliações de vários restaurantes do arquivo restaurantes.txt.
+    O arquivo é indexado uma única vez, então cada nome custa apenas uma busca no índice.
     
-    return {restaurant_name: reviews}
+    Args:
+        restaurant_names: Nomes dos restaurantes a serem pesquisados
+        
+    Returns:
+        Dicionário com o nome de cada restaurante como chave e lista de avaliações como valor
+    """
+    mtime = _reviews_mtime()
+    return {name: list(_fetch_cached(name, mtime)) for name in restaurant_names}
+
+
+def _score_kernel(food_scores: Sequence[int], customer_service_scores: Sequence[int]) -> float:
+    """
+    Soma sqrt(food^2 * service) para cada par de scores em um único laço, sem listas intermediárias.
+    """
+    total = 0.0
+    sqrt = math.sqrt
+    for food, service in zip(food_scores, customer_service_scores):
+        total += sqrt(food * food * service)
+    return total
 
 
 def calculate_overall_score(
     restaurant_name: str, 
-    food_scores: List[int], 
-    customer_service_scores: List[int]
+    food_scores: Sequence[int], 
+    customer_service_scores: Sequence[int]
 ) -> Dict[str, float]:
     """
     Calcula a pontuação geral de um restaurante baseada nos scores de comida e atendimento.
@@ -62,53 +209,30 @@ def calculate_overall_score(
         return {restaurant_name: 0.000}
     
     n = len(food_scores)
-    total_score = 0.0
-    
-    for i in range(n):
-        score_component = math.sqrt(food_scores[i]**2 * customer_service_scores[i])
-        total_score += score_component
+    total_score = _score_kernel(food_scores, customer_service_scores)
     
-    final_score = total_score * (1 / (n * math.sqrt(125))) * 10
+    final_score = total_score * _INV_SQRT_125_TIMES_10 / n
     
     return {restaurant_name: round(final_score, 3)}
 
 
-def get_data_fetch_agent_prompt(restaurant_query: str) -> str:
+def _valid_scores(food_scores: Any, customer_service_scores: Any) -> bool:
     """
-    Gera prompt para o agente de busca de dados.
-    
-    Args:
-        restaurant_query: Consulta do usuário sobre o restaurante
-        
-    Returns:
-        Prompt formatado para o agente
-    """
-    return f"""
-    Você é um agente especializado em recuperar dados de restaurantes.
-    Sua única tarefa é identificar o nome do restaurante na consulta e usar a função fetch_restaurant_data.
-    
-    Consulta: "{restaurant_query}"
-    
-    INSTRUÇÕES:
-    1. Identifique exatamente o nome do restaurante (ex: "Bob's", "Paris 6", "KFC", "China in Box")
-    2. Chame OBRIGATORIAMENTE a função fetch_restaurant_data com o nome correto
-    3. Retorne as avaliações encontradas para o próximo agente
-    
-    SEMPRE use a função fetch_restaurant_data - não tente responder sem ela.
+    Verifica se os scores retornados pelo modelo são listas não vazias, de mesmo tamanho,
+    com inteiros da escala de 1 a 5, antes de passá-los a calculate_overall_score.
     """
+    if not isinstance(food_scores, list) or not isinstance(customer_service_scores, list):
+        return False
+    if not food_scores or len(food_scores) != len(customer_service_scores):
+        return False
+    return all(
+        isinstance(score, int) and not isinstance(score, bool) and 1 <= score <= 5
+        for score in food_scores + customer_service_scores
+    )
 
 
-def get_review_analysis_agent_prompt() -> str:
-    """
-    Gera prompt para o agente de análise de avaliações.
-    
-    Returns:
-        Prompt formatado para o agente de análise
-    """
-    return """
-    Você é um agente especializado em análise de sentimentos para avaliações de restaurantes.
-    Analise as avaliações recebidas e extraia scores numéricos para comida e atendimento.
-    
+# Escala de conversão de adjetivos em scores, comum a todos os prompts de análise
+_REVIEW_SCALE_PROMPT = """
     ESCALA OBRIGATÓRIA (NÃO MODIFICAR):
     - 1/5: horrível, nojento, terrível
     - 2/5: ruim, desagradável, ofensivo  
@@ -116,164 +240,453 @@ def get_review_analysis_agent_prompt() -> str:
     - 4/5: bom, agradável, satisfatório
     - 5/5: incrível, impressionante, surpreendente
     
-    PROCESSO:
-    1. Para cada avaliação recebida, identifique aspectos de COMIDA e ATENDIMENTO
-    2. Converta adjetivos usando EXATAMENTE a escala acima
-    3. Retorne no formato: "food_scores: [X,Y,Z] customer_service_scores: [A,B,C]"
-    
     MAPEAMENTO DE CONTEXTO:
     - COMIDA: comida, sabor, ingredientes, pratos, qualidade, saboroso, preparado, sanduíches, hambúrgueres
     - ATENDIMENTO: atendimento, funcionários, serviço, garçons, baristas, eficiente
     
     Se uma avaliação não mencionar especificamente um aspecto, use score 3 (mediano).
-    """
+"""
 
 
-def get_score_agent_prompt() -> str:
+def get_unified_agent_prompt() -> str:
     """
-    Gera prompt para o agente de cálculo de pontuação.
+    Gera prompt para o agente unificado, que busca os dados e analisa as avaliações
+    em uma única conversa. A consulta do usuário chega na mensagem inicial, o que
+    permite reutilizar o mesmo agente entre consultas. A pontuação final é calculada em Python.
     
     Returns:
-        Prompt formatado para o agente de pontuação
+        Prompt formatado para o agente
     """
-    return """
-    Você é responsável por calcular a pontuação final do restaurante.
-    Receba os scores do agente anterior e use a função calculate_overall_score.
+    return f"""
+    Você é um agente especializado em avaliar restaurantes a partir de suas avaliações.
+    Você receberá uma consulta do usuário sobre um restaurante.
     
-    INSTRUÇÕES:
-    1. Extraia food_scores e customer_service_scores da mensagem anterior
-    2. SEMPRE chame a função calculate_overall_score com:
-       - restaurant_name: nome do restaurante
-       - food_scores: lista de integers [1,2,3,etc]  
-       - customer_service_scores: lista de integers [1,2,3,etc]
-    3. Retorne a pontuação com exatamente 3 casas decimais
+    ETAPA 1 - BUSCA DE DADOS:
+    1. Identifique exatamente o nome do restaurante (ex: "Bob's", "Paris 6", "KFC", "China in Box")
+    2. Chame OBRIGATORIAMENTE a função fetch_restaurant_data com o nome correto
     
+    ETAPA 2 - ANÁLISE DAS AVALIAÇÕES:
+    Para cada avaliação recebida, identifique aspectos de COMIDA e ATENDIMENTO e converta
+    os adjetivos usando EXATAMENTE a escala abaixo.
+    
+{_REVIEW_SCALE_PROMPT}    
     FORMATO ESPERADO:
-    "A avaliação média do [RESTAURANTE] é [X.XXX]."
+    "food_scores: [X,Y,Z] customer_service_scores: [A,B,C]"
     
-    SEMPRE use a função - não calcule manualmente.
+    SEMPRE use a função fetch_restaurant_data - não responda sem ela.
+    NÃO calcule a pontuação final - apenas retorne os scores.
     """
 
 
-def main(user_query: str) -> None:
+def get_marshaled_agent_prompt() -> str:
     """
-    Função principal que coordena o sistema de agentes conversacionais.
+    Gera prompt para o agente que avalia várias consultas em uma única chamada.
     
-    Args:
-        user_query: Consulta do usuário sobre um restaurante
+    Returns:
+        Prompt formatado para o agente
+    """
+    return f"""
+    Você é um agente especializado em analisar avaliações de vários restaurantes de uma só vez.
+    Você receberá uma lista numerada de consultas, cada uma sobre um restaurante.
+    
+    PROCESSO:
+    1. Identifique exatamente o nome do restaurante de cada consulta (ex: "Bob's", "Paris 6", "KFC", "China in Box")
+    2. Chame UMA vez a função fetch_restaurants_data com a lista de TODOS os restaurantes
+    3. Para cada avaliação recebida, identifique aspectos de COMIDA e ATENDIMENTO e converta
+       os adjetivos usando EXATAMENTE a escala abaixo
+    {_REVIEW_SCALE_PROMPT}
+    FORMATO ESPERADO (apenas JSON, uma entrada por consulta, na mesma ordem):
+    [{{"restaurant": "Nome", "food_scores": [X,Y,Z], "customer_service_scores": [A,B,C]}}]
+    
+    NÃO calcule a pontuação final - apenas retorne os scores.
+    """
+
+
+_UNIFIED_PROMPT = get_unified_agent_prompt()
+_MARSHALED_PROMPT = get_marshaled_agent_prompt()
+
+# Uma rodada para a chamada da função de busca e outra para a resposta com os scores
+_MAX_TURNS = 2
+
+_FAILURE_MESSAGE = "Não foi possível processar a consulta adequadamente."
+
+
+def _is_final_answer(message: Dict) -> bool:
+    """
+    Encerra a conversa assim que o analista responde com texto em vez de chamar uma função.
     """
-    llm_config = {
-        "config_list": [
-            {"model": "gpt-4o-mini", "api_key": os.environ.get("OPENAI_API_KEY")}
-        ]
-    }
+    return bool(message.get('content')) and not message.get('tool_calls')
+
+
+def _build_agents(
+    system_message: str,
+    batch_fetch: bool = False
+) -> Tuple[ConversableAgent, ConversableAgent]:
+    """
+    Cria o par de agentes (ponto de entrada e analista) com as funções de busca registradas.
     
-    # Agente supervisor/ponto de entrada
+    Args:
+        system_message: Prompt do agente analista
+        batch_fetch: Se fetch_restaurants_data também deve ser oferecida ao modelo
+        
+    Returns:
+        Tupla (entrypoint_agent, unified_agent)
+    """
+    # Agente ponto de entrada, responsável por executar as funções
     entrypoint_agent = ConversableAgent(
         "entrypoint_agent",
         system_message="""
-        Você é o agente supervisor responsável por coordenar o processo de análise de restaurantes.
-        Coordene a execução sequencial dos outros agentes e formate a resposta final para o usuário.
+        Você é o agente responsável por executar as funções solicitadas e repassar seus resultados.
         """,
-        llm_config=llm_config,
-        human_input_mode="NEVER"
+        llm_config=_LLM_CONFIG,
+        human_input_mode="NEVER",
+        is_termination_msg=_is_final_answer
     )
     
-    # Agente de busca de dados
-    data_fetch_agent = ConversableAgent(
-        "data_fetch_agent",
-        system_message=get_data_fetch_agent_prompt(user_query),
-        llm_config=llm_config,
+    # Agente unificado: busca e análise em uma única conversa
+    unified_agent = ConversableAgent(
+        "unified_agent",
+        system_message=system_message,
+        llm_config=_LLM_CONFIG,
         human_input_mode="NEVER"
     )
     
-    # Registrar função no entrypoint_agent para que todos possam usá-la
-    entrypoint_agent.register_for_llm(
+    unified_agent.register_for_llm(
         name="fetch_restaurant_data", 
         description="Obtém as avaliações de um restaurante específico."
     )(fetch_restaurant_data)
     entrypoint_agent.register_for_execution(name="fetch_restaurant_data")(fetch_restaurant_data)
     
-    # Registrar também no data_fetch_agent
-    data_fetch_agent.register_for_llm(
-        name="fetch_restaurant_data", 
-        description="Obtém as avaliações de um restaurante específico."
-    )(fetch_restaurant_data)
-    data_fetch_agent.register_for_execution(name="fetch_restaurant_data")(fetch_restaurant_data)
+    if batch_fetch:
+        unified_agent.register_for_llm(
+            name="fetch_restaurants_data",
+            description="Obtém as avaliações de vários restaurantes em uma única chamada."
+        )(fetch_restaurants_data)
+        entrypoint_agent.register_for_execution(name="fetch_restaurants_data")(fetch_restaurants_data)
     
-    # Agente de análise de avaliações
-    review_analysis_agent = ConversableAgent(
-        "review_analysis_agent",
-        system_message=get_review_analysis_agent_prompt(),
-        llm_config=llm_config,
-        human_input_mode="NEVER"
+    return entrypoint_agent, unified_agent
+
+
+@lru_cache(maxsize=None)
+def _get_agents(
+    system_message: str,
+    batch_fetch: bool = False
+) -> Tuple[ConversableAgent, ConversableAgent]:
+    """
+    Retorna o par de agentes para o prompt informado, criando-o apenas na primeira chamada.
+    Cada conversa limpa o histórico ao iniciar, então o par pode ser reutilizado em
+    chamadas sequenciais; execuções concorrentes devem usar _build_agents.
+    """
+    return _build_agents(system_message, batch_fetch)
+
+
+# Executor para buscar avaliações em segundo plano enquanto o modelo responde
+_PREFETCH_EXECUTOR = ThreadPoolExecutor(max_workers=1, thread_name_prefix="prefetch")
+
+
+def _prefetch_reviews(user_query: str) -> None:
+    """
+    Dispara em segundo plano a busca das avaliações do restaurante citado na consulta, para que
+    a chamada de fetch_restaurant_data feita pelo modelo encontre o resultado já em cache.
+    Se o nome não puder ser extraído da consulta, a busca fica a cargo do modelo.
+    """
+    restaurant_match = _RESTAURANT_RE.search(user_query)
+    if restaurant_match:
+        _PREFETCH_EXECUTOR.submit(
+            _fetch_cached, restaurant_match.group(1).strip(), _reviews_mtime()
+        )
+
+
+def _fetched_restaurant_name(chat_history: List[Dict]) -> Optional[str]:
+    """
+    Recupera o nome do restaurante usado pelo modelo na chamada de fetch_restaurant_data.
+    """
+    for message in chat_history:
+        for tool_call in message.get('tool_calls') or []:
+            function = tool_call.get('function') or {}
+            if function.get('name') != "fetch_restaurant_data":
+                continue
+            try:
+                return _json_loads(function.get('arguments') or '{}').get('restaurant_name')
+            except ValueError:
+                return None
+    return None
+
+
+def _parse_scores(text: str) -> List[int]:
+    """
+    Converte o conteúdo de uma lista de scores ("3, 4, 5") em uma lista de inteiros.
+    """
+    return [int(x) for x in text.split(',')]
+
+
+def _query_restaurant(user_query: str) -> Optional[str]:
+    """
+    Extrai o nome do restaurante da consulta, se ela seguir o formato "... do/da <nome>?".
+    """
+    restaurant_match = _RESTAURANT_RE.search(user_query)
+    return restaurant_match.group(1).strip() if restaurant_match else None
+
+
+def _format_answer(restaurant: str, score: float) -> str:
+    """
+    Formata a pontuação final de um restaurante para o usuário.
+    """
+    return f"A avaliação média do {restaurant} é {score:.3f}."
+
+
+def _score_answer(chat_history: List[Dict], user_query: str) -> Optional[Tuple[str, float]]:
+    """
+    Extrai os scores da conversa e calcula a pontuação final.
+    
+    Args:
+        chat_history: Mensagens trocadas entre os agentes
+        user_query: Consulta do usuário sobre um restaurante
+        
+    Returns:
+        Tupla (restaurante, pontuação), ou None se a conversa não contiver scores válidos
+    """
+    # Localiza a mensagem com os scores, da última para a primeira
+    scores_match = None
+    for message in reversed(chat_history):
+        scores_match = _SCORES_RE.search(message.get('content') or '')
+        if scores_match:
+            break
+    
+    if not scores_match:
+        return None
+    
+    try:
+        food_scores = _parse_scores(scores_match.group(1))
+        customer_service_scores = _parse_scores(scores_match.group(2))
+    except ValueError:
+        return None
+    
+    if not _valid_scores(food_scores, customer_service_scores):
+        return None
+    
+    restaurant = (
+        _query_restaurant(user_query)
+        or _fetched_restaurant_name(chat_history)
+        or "restaurante"
     )
     
-    # Agente de cálculo de pontuação
-    score_agent = ConversableAgent(
-        "score_agent",
-        system_message=get_score_agent_prompt(),
-        llm_config=llm_config,
-        human_input_mode="NEVER"
+    result = calculate_overall_score(restaurant, food_scores, customer_service_scores)
+    return restaurant, result[restaurant]
+
+
+def _fallback_result(final_chat) -> str:
+    """
+    Resposta usada quando a conversa não traz scores válidos: o último texto do modelo
+    ou, na falta dele, a mensagem de falha.
+    """
+    chat_history = getattr(final_chat, 'chat_history', None)
+    if not chat_history:
+        return _FAILURE_MESSAGE
+    # Com o limite de turnos, a última mensagem pode ser uma chamada de função sem texto
+    return chat_history[-1].get('content') or _FAILURE_MESSAGE
+
+
+def _format_result(final_chat, user_query: str) -> str:
+    """
+    Formata a resposta final da conversa para o usuário.
+    
+    Args:
+        final_chat: Resultado da conversa entre os agentes
+        user_query: Consulta do usuário sobre um restaurante
+        
+    Returns:
+        Texto da resposta final
+    """
+    scored = _score_answer(getattr(final_chat, 'chat_history', None) or [], user_query)
+    if scored is None:
+        return _fallback_result(final_chat)
+    return _format_answer(*scored)
+
+
+def _normalize_query(user_query: str) -> str:
+    """
+    Normaliza a consulta para uso como chave de cache, ignorando caixa, pontuação e espaços extras.
+    """
+    return " ".join(_PUNCTUATION_RE.sub(" ", user_query.casefold()).split())
+
+
+def _cache_answer(key: Tuple[str, int], answer: Tuple[str, float]) -> None:
+    """
+    Guarda a pontuação de uma consulta, descartando a menos usada quando o cache está cheio.
+    """
+    _ANSWER_CACHE[key] = answer
+    _ANSWER_CACHE.move_to_end(key)
+    if len(_ANSWER_CACHE) > _ANSWER_CACHE_SIZE:
+        _ANSWER_CACHE.popitem(last=False)
+
+
+def main(user_query: str) -> None:
+    """
+    Função principal que coordena o sistema de agentes conversacionais.
+    Consultas repetidas são respondidas do cache enquanto restaurantes.txt não mudar.
+    
+    Args:
+        user_query: Consulta do usuário sobre um restaurante
+    """
+    key = (_normalize_query(user_query), _reviews_mtime())
+    cached = _ANSWER_CACHE.get(key)
+    if cached is not None:
+        _ANSWER_CACHE.move_to_end(key)
+        restaurant, score = cached
+        print(_format_answer(_query_restaurant(user_query) or restaurant, score))
+        return
+    
+    _prefetch_reviews(user_query)
+    entrypoint_agent, unified_agent = _get_agents(_UNIFIED_PROMPT)
+    
+    # Executa o pipeline em uma única conversa: busca -> análise -> scores
+    final_chat = entrypoint_agent.initiate_chat(
+        unified_agent,
+        message=f"Avalie o restaurante da consulta: {user_query}",
+        max_turns=_MAX_TURNS
     )
     
-    # Registrar função no entrypoint_agent
-    entrypoint_agent.register_for_llm(
-        name="calculate_overall_score",
-        description="Calcula a pontuação final do restaurante baseada nos scores."
-    )(calculate_overall_score)
-    entrypoint_agent.register_for_execution(name="calculate_overall_score")(calculate_overall_score)
-    
-    # Registrar também no score_agent
-    score_agent.register_for_llm(
-        name="calculate_overall_score",
-        description="Calcula a pontuação final do restaurante baseada nos scores."
-    )(calculate_overall_score)
-    score_agent.register_for_execution(name="calculate_overall_score")(calculate_overall_score)
-    
-    # Configuração do fluxo de conversação
-    chat_sequence = [
-        {
-            "sender": entrypoint_agent,
-            "recipient": data_fetch_agent,
-            "message": f"Recupere as avaliações para: {user_query}",
-            "max_turns": 3
-        },
-        {
-            "sender": data_fetch_agent,
-            "recipient": review_analysis_agent,
-            "message": "Analise as avaliações e extraia scores de comida e atendimento usando a escala definida.",
-            "max_turns": 3
-        },
-        {
-            "sender": review_analysis_agent,
-            "recipient": score_agent,
-            "message": "Calcule a pontuação final do restaurante usando os scores extraídos.",
-            "max_turns": 3
-        }
-    ]
+    # Apenas respostas com pontuação calculada entram no cache
+    scored = _score_answer(getattr(final_chat, 'chat_history', None) or [], user_query)
+    if scored is None:
+        print(_fallback_result(final_chat))
+        return
     
-    # Executa o pipeline de agentes
-    result = entrypoint_agent.initiate_chats(chat_sequence)
+    _cache_answer(key, scored)
+    print(_format_answer(*scored))
+
+
+async def _a_evaluate(user_query: str, semaphore: asyncio.Semaphore) -> str:
+    """
+    Executa o pipeline de agentes para uma consulta de forma assíncrona.
     
-    # Exibe a resposta final
-    if result and len(result) > 0:
-        final_chat = result[-1]
-        if hasattr(final_chat, 'chat_history') and final_chat.chat_history:
-            last_message = final_chat.chat_history[-1]['content']
-            
-            # Extrai a pontuação da resposta e formata adequadamente
-            score_match = re.search(r'(\d+\.\d{3})', last_message)
-            restaurant_match = re.search(r'(?:do|da) ([^?]+)\?', user_query, re.IGNORECASE)
+    Args:
+        user_query: Consulta do usuário sobre um restaurante
+        semaphore: Limita o número de conversas simultâneas
+        
+    Returns:
+        Texto da resposta final
+    """
+    _prefetch_reviews(user_query)
+    async with semaphore:
+        # Conversas simultâneas não podem compartilhar o histórico dos agentes
+        entrypoint_agent, unified_agent = _build_agents(_UNIFIED_PROMPT)
+        final_chat = await entrypoint_agent.a_initiate_chat(
+            unified_agent,
+            message=f"Avalie o restaurante da consulta: {user_query}",
+            max_turns=_MAX_TURNS
+        )
+    return _format_result(final_chat, user_query)
+
+
+def main_batch(queries: List[str], max_concurrency: int = 4) -> None:
+    """
+    Avalia várias consultas em paralelo, exibindo as respostas na ordem recebida.
+    
+    Args:
+        queries: Consultas do usuário, uma por restaurante
+        max_concurrency: Número máximo de conversas simultâneas com o modelo
+    """
+    async def run_all() -> List[str]:
+        semaphore = asyncio.Semaphore(max_concurrency)
+        return await asyncio.gather(
+            *(_a_evaluate(query, semaphore) for query in queries)
+        )
+    
+    for answer in asyncio.run(run_all()):
+        print(answer)
+
+
+def _parse_marshaled_scores(final_chat) -> List[Dict]:
+    """
+    Localiza, da última mensagem para a primeira, a lista JSON de scores retornada pelo modelo.
+    
+    Args:
+        final_chat: Resultado da conversa entre os agentes
+        
+    Returns:
+        Lista de dicionários com restaurant, food_scores e customer_service_scores
+    """
+    for message in reversed(getattr(final_chat, 'chat_history', None) or []):
+        content = message.get('content') or ''
+        start, end = content.find('['), content.rfind(']')
+        if start == -1 or end <= start:
+            continue
+        try:
+            rows = _json_loads(content[start:end + 1])
+        except ValueError:
+            continue
+        if isinstance(rows, list) and all(isinstance(row, dict) and "restaurant" in row for row in rows):
+            return rows
+    return []
+
+
+def _match_marshaled_rows(chunk: List[str], rows: List[Dict]) -> List[Optional[Dict]]:
+    """
+    Associa cada consulta do lote à linha retornada pelo modelo para o seu restaurante.
+    
+    Args:
+        chunk: Consultas enviadas na conversa
+        rows: Linhas de scores retornadas pelo modelo
+        
+    Returns:
+        Uma linha por consulta, na ordem de chunk, ou None quando o modelo a omitiu
+    """
+    rows = [row for row in rows if isinstance(row.get("restaurant"), str) and row["restaurant"].strip()]
+    unused = list(range(len(rows)))
+    matched: List[Optional[Dict]] = []
+    
+    for i, query in enumerate(chunk):
+        # Prefere a linha cujo restaurante aparece na consulta; senão, usa a posição quando
+        # o modelo retornou exatamente uma linha por consulta
+        index = next(
+            (j for j in unused if rows[j]["restaurant"].strip().casefold() in query.casefold()),
+            i if len(rows) == len(chunk) and i in unused else None
+        )
+        if index is None:
+            matched.append(None)
+            continue
+        unused.remove(index)
+        matched.append(rows[index])
+    
+    return matched
+
+
+def main_marshaled(queries: List[str], batch_size: int = 8) -> None:
+    """
+    Avalia várias consultas agrupando até batch_size delas em uma mesma conversa com o modelo.
+    O modelo retorna apenas os scores; a pontuação final é calculada em Python. Cada consulta
+    gera uma linha de resposta, com a mensagem de falha quando o modelo a omite ou retorna
+    scores inválidos.
+    
+    Args:
+        queries: Consultas do usuário, uma por restaurante
+        batch_size: Número de consultas enviadas em cada conversa (ajustar conforme o modelo)
+    """
+    for start in range(0, len(queries), batch_size):
+        chunk = queries[start:start + batch_size]
+        for query in chunk:
+            _prefetch_reviews(query)
+        entrypoint_agent, marshaled_agent = _get_agents(_MARSHALED_PROMPT, batch_fetch=True)
+        numbered = "\n".join(f"{i}. {query}" for i, query in enumerate(chunk, 1))
+        final_chat = entrypoint_agent.initiate_chat(
+            marshaled_agent,
+            message=f"Avalie os restaurantes das consultas:\n{numbered}",
+            max_turns=_MAX_TURNS
+        )
+        
+        rows = _parse_marshaled_scores(final_chat)
+        for row in _match_marshaled_rows(chunk, rows):
+            if row is None or not _valid_scores(row.get("food_scores"), row.get("customer_service_scores")):
+                print(_FAILURE_MESSAGE)
+                continue
             
-            if score_match and restaurant_match:
-                score = score_match.group(1)
-                restaurant = restaurant_match.group(1).strip()
-                print(f"A avaliação média do {restaurant} é {score}.")
-            else:
-                print(last_message)
-        else:
-            print("Não foi possível processar a consulta adequadamente.")
+            restaurant = row["restaurant"]
+            result = calculate_overall_score(
+                restaurant, row["food_scores"], row["customer_service_scores"]
+            )
+            print(_format_answer(restaurant, result[restaurant]))
 
 # NÃO modifique o código abaixo.
 if __name__ == "__main__":